@@ -1,10 +1,23 @@
 #!/usr/bin/env python3
+import atexit
+import functools
+import logging
+import logging.handlers
+import queue
 import re
 import sys
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import parse_qs, urlparse
+import threading
+from collections import deque
+from html import escape
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs, unquote_plus, urlparse
 from pathlib import Path
-from typing import Dict, Optional, List, Any
+from typing import Dict, Optional, List, Any, Tuple, Callable, Deque, ClassVar
+
+try:
+    import numpy as np
+except ImportError:  # NumPy нужен только для пакетной конвертации (convert_array)
+    np = None
 
 # Конфигурация единиц измерения
 # Вынесена в константу для удобства редактирования
@@ -50,64 +63,216 @@ UNITS_CONFIG = {
     }
 }
 
+# Плоские таблицы по ключу (категория, единица) вместо вложенных словарей UNITS_CONFIG
+FACTORS: Dict[Tuple[str, str], float] = {
+    (category, code): info['factor']
+    for category, config in UNITS_CONFIG.items()
+    for code, info in config['units'].items()
+    if 'factor' in info
+}
+UNIT_NAMES: Dict[Tuple[str, str], str] = {
+    (category, code): info['name']
+    for category, config in UNITS_CONFIG.items()
+    for code, info in config['units'].items()
+}
 
-class TemplateEngine:
-    """
-    Простой шаблонизатор для рендеринга HTML без внешних зависимостей (типа Jinja2).
-    Поддерживает {{ var }}, {% if var %} и {% for item in list %}.
-    """
+# Готовые коэффициенты для каждой пары единиц линейных величин:
+# (категория, из, в) -> множитель. Считаются один раз при импорте.
+FACTOR_TABLE: Dict[Tuple[str, str, str], float] = {
+    (category, from_unit, to_unit): from_factor / to_factor
+    for (category, from_unit), from_factor in FACTORS.items()
+    for (to_category, to_unit), to_factor in FACTORS.items()
+    if to_category == category
+}
 
-    def __init__(self, template_name: str):
-        self.template_path = Path(__file__).parent / template_name
+# Функции конвертации температур для каждой пары единиц: (из, в) -> функция
+TEMP_FNS: Dict[Tuple[str, str], Callable[[float], float]] = {
+    ('c', 'c'): lambda v: v,
+    ('c', 'f'): lambda v: v * 9 / 5 + 32,
+    ('c', 'k'): lambda v: v + 273.15,
+    ('f', 'c'): lambda v: (v - 32) * 5 / 9,
+    ('f', 'f'): lambda v: v,
+    ('f', 'k'): lambda v: (v - 32) * 5 / 9 + 273.15,
+    ('k', 'c'): lambda v: v - 273.15,
+    ('k', 'f'): lambda v: (v - 273.15) * 9 / 5 + 32,
+    ('k', 'k'): lambda v: v,
+}
+
+# Шаблон разбирается одним проходом по тегам: {{ var }} и {% ... %}
+# Работаем прямо с bytes: статика шаблона не декодируется и не кодируется заново на каждый ответ
+TAG_PATTERN = re.compile(rb'\{\{ (\w+) \}\}|\{% (.*?) %\}')
+IF_STATEMENT = re.compile(rb'if (\w+)')
 
-    def render(self, context: Dict[str, Any]) -> str:
-        if not self.template_path.exists():
-            return "<h1>Error: Template file not found.</h1>"
+# Опкоды скомпилированного шаблона:
+# (TEXT, fmt), (IF, var, body, else_body)
+# TEXT - кусок шаблона между блоками, где {{ var }} заменены на %(var)s: подстановка всех
+# переменных делается одним оператором % (один проход на C вместо цикла по ключам)
+TEXT, IF = 'T', 'I'
 
-        with open(self.template_path, 'r', encoding='utf-8') as f:
-            content = f.read()
 
-        # 1. Обработка циклов (самая сложная часть, делаем сначала)
-        # Ищем паттерн: {% for item in history %} ... {% else %} ... {% endfor %}
-        loop_pattern = re.compile(r'\{% for item in (\w+) %\}(.*?)\{% else %\}(.*?)\{% endfor %\}', re.DOTALL)
+class SafeDict(dict):
+    """Значения для подстановки в TEXT-опкоды; отсутствующие переменные дают пустую строку."""
 
-        def loop_replacer(match):
-            list_name = match.group(1)
-            loop_body = match.group(2)
-            else_body = match.group(3)
+    def __missing__(self, key: bytes) -> bytes:
+        return b''
 
-            items = context.get(list_name, [])
-            if not items:
-                return else_body
 
-            result_html = ""
-            for item in items:
-                # Простая подстановка атрибутов словаря
-                temp = loop_body
-                for key, val in item.items():
-                    temp = temp.replace(f'{{{{ item.{key} }}}}', str(val))
-                result_html = temp + result_html  # Новые записи сверху
-            return result_html
+def _template_values(context: Dict[str, Any]) -> SafeDict:
+    """
+    Кодирует простые значения контекста (str/int/float) в bytes для подстановки.
+    Оператор % над bytes ищет %(var)s по ключу-bytes, поэтому ключи тоже кодируются.
+    """
+    return SafeDict(
+        (key.encode('utf-8'), str(value).encode('utf-8'))
+        for key, value in context.items()
+        if isinstance(value, (str, int, float))
+    )
+
 
-        content = loop_pattern.sub(loop_replacer, content)
+@functools.lru_cache(maxsize=8)
+def _load_template(path: str) -> bytes:
+    """Читает шаблон с диска один раз; дальше содержимое берется из кэша."""
+    return Path(path).read_bytes()
 
-        # 2. Обработка условий {% if var %}
-        # Если переменная есть и правдива - показываем контент, иначе вырезаем
-        if_pattern = re.compile(r'\{% if (\w+) %\}(.*?)\{% endif %\}', re.DOTALL)
 
-        def if_replacer(match):
-            var_name = match.group(1)
-            inner_content = match.group(2)
-            return inner_content if context.get(var_name) else ""
+def _compile(source: bytes) -> List[tuple]:
+    """
+    Компилирует текст шаблона в дерево опкодов за один проход по тегам.
+    Незнакомые теги {% ... %} остаются в выводе как обычный текст.
+    """
+    root: List[tuple] = []
+    ops = root
+    # Открытые блоки {% if %}: [IF, имя, тело, else-тело] и список опкодов родителя
+    stack: List[Tuple[list, List[tuple]]] = []
+    # Текущий TEXT-опкод собирается по кускам; литеральные % экранируются для оператора %
+    text: List[bytes] = []
+    pos = 0
+
+    def flush():
+        fmt = b"".join(text)
+        if fmt:
+            ops.append((TEXT, fmt))
+        text.clear()
+
+    for match in TAG_PATTERN.finditer(source):
+        var_name, statement = match.groups()
+        if var_name is None:
+            if_match = IF_STATEMENT.fullmatch(statement)
+            top = stack[-1][0] if stack else None
+            if not (if_match or statement in (b'else', b'endif')):
+                continue  # Незнакомый тег - часть литерала
+
+        text.append(source[pos:match.start()].replace(b'%', b'%%'))
+        pos = match.end()
+
+        if var_name is not None:
+            text.append(b'%(' + var_name + b')s')
+            continue
+
+        flush()
+        if if_match:
+            block = [IF, if_match.group(1).decode('ascii'), [], []]
+            stack.append((block, ops))
+            ops = block[2]
+        elif statement == b'else':
+            if top is None:
+                raise ValueError("{% else %} outside of {% if %}")
+            ops = top[3]
+        else:
+            if top is None:
+                raise ValueError("Unexpected {% endif %}")
+            block, ops = stack.pop()
+            ops.append(tuple(block))
+
+    if stack:
+        raise ValueError("Unclosed block in template")
+    text.append(source[pos:].replace(b'%', b'%%'))
+    flush()
+    return root
+
+
+@functools.lru_cache(maxsize=8)
+def _compile_template(path: str) -> List[tuple]:
+    """Компилирует шаблон один раз; при рендере остается только исполнить опкоды."""
+    return _compile(_load_template(path))
+
+
+@functools.lru_cache(maxsize=256)
+def _specialize(path: str, scalars: Tuple[Tuple[str, Any], ...]) -> Tuple[Any, ...]:
+    """
+    Подставляет в скомпилированный шаблон простые значения контекста (str/int/float)
+    и склеивает получившуюся статику в готовые bytes.
+    Условие {% if var %} по переменной, которой нет среди простых значений (не передана
+    или, например, None), остается опкодом и проверяется на каждый запрос.
+    Для текущего шаблона таких условий нет, и результат - одна готовая строка bytes.
+    """
+    context = dict(scalars)
+    values = _template_values(context)
+    result: List[Any] = []
+    text: List[bytes] = []
+
+    def flush():
+        if text:
+            result.append(b"".join(text))
+            text.clear()
+
+    def walk(segments: List[tuple]):
+        for segment in segments:
+            kind = segment[0]
+            if kind == TEXT:
+                text.append(segment[1] % values)
+            elif kind == IF and segment[1] in context:
+                walk(segment[2] if context[segment[1]] else segment[3])
+            else:
+                flush()
+                result.append(segment)
+
+    walk(_compile_template(path))
+    flush()
+    return tuple(result)
+
 
-        content = if_pattern.sub(if_replacer, content)
+class TemplateEngine:
+    """
+    Простой шаблонизатор для рендеринга HTML без внешних зависимостей (типа Jinja2).
+    Поддерживает {{ var }} и {% if var %} ... {% else %} ... {% endif %}.
+    """
 
-        # 3. Подстановка простых переменных {{ var }}
-        for key, value in context.items():
-            if isinstance(value, (str, int, float)):
-                content = content.replace(f'{{{{ {key} }}}}', str(value))
+    def __init__(self, template_name: str):
+        self.template_path = Path(__file__).parent / template_name
 
-        return content
+    def render(self, context: Dict[str, Any]) -> bytes:
+        # Ключ кэша - только простые значения
+        scalars = tuple((key, value) for key, value in context.items() if isinstance(value, (str, int, float)))
+        try:
+            specialized = _specialize(str(self.template_path), scalars)
+        except FileNotFoundError:
+            return b"<h1>Error: Template file not found.</h1>"
+
+        # Обычно здесь только готовые bytes; опкоды остаются лишь для условий
+        # по переменным вне ключа кэша (см. _specialize)
+        parts: List[bytes] = []
+        values: Optional[SafeDict] = None
+        for part in specialized:
+            if isinstance(part, bytes):
+                parts.append(part)
+                continue
+            if values is None:
+                values = _template_values(context)
+            self._render_segments([part], context, values, parts)
+        return b"".join(parts)
+
+    def _render_segments(self, segments: List[tuple], context: Dict[str, Any], values: SafeDict,
+                         parts: List[bytes]):
+        for segment in segments:
+            kind = segment[0]
+            if kind == TEXT:
+                parts.append(segment[1] % values)
+
+            elif kind == IF:
+                # Если переменная есть и правдива - показываем тело, иначе ветку else
+                branch = segment[2] if context.get(segment[1]) else segment[3]
+                self._render_segments(branch, context, values, parts)
 
 
 class ConverterService:
@@ -115,70 +280,142 @@ class ConverterService:
 
     @staticmethod
     def convert(category: str, value: float, from_unit: str, to_unit: str) -> Optional[float]:
-        if category not in UNITS_CONFIG:
+        converter = _make_converter(category, from_unit, to_unit)
+        if converter is None:
             return None
+        return converter(value)
 
-        # Специфичная логика для температур
-        if category == 'temperature':
-            return ConverterService._convert_temp(value, from_unit, to_unit)
-
-        # Логика для линейных величин (через базовую единицу)
-        units = UNITS_CONFIG[category]['units']
-        if from_unit not in units or to_unit not in units:
+    @staticmethod
+    def convert_array(category: str, values: Any, from_unit: str, to_unit: str) -> Optional[Any]:
+        """
+        Пакетная конвертация последовательности чисел (требует NumPy).
+        Те же функции конвертации применяются ко всему массиву сразу векторными операциями NumPy.
+        """
+        if np is None:
+            raise RuntimeError("NumPy is required for convert_array")
+
+        converter = _make_converter(category, from_unit, to_unit)
+        if converter is None:
             return None
+        # np.array всегда копирует, поэтому исходные данные не меняются
+        return converter(np.array(values, dtype=np.float64))
+
+
+# Лог запросов; обработчики подключаются в start_access_log (один раз на процесс)
+access_log = logging.getLogger('unit_converter.access')
+access_log.setLevel(logging.INFO)
+access_log.propagate = False
+_access_listener: Optional[logging.handlers.QueueListener] = None
+_access_log_lock = threading.Lock()
+
+# Статусная строка и статичные заголовки ответа собираются заранее;
+# Server, Date и Content-Length дописываются на каждый ответ
+RESPONSE_HEAD = (
+    b"HTTP/1.1 200 OK\r\n"
+    b"Content-Type: text/html; charset=utf-8\r\n"
+)
+
+# Разметка одной записи истории; подставляется один раз при добавлении записи
+HISTORY_ITEM_HTML = (
+    '<li class="history-item">'
+    '<span>{from_val}</span>'
+    '<span class="arrow-icon">➝</span>'
+    '<span>{to_val}</span>'
+    '</li>'
+)
+
+# Поля формы, которые читает do_POST
+FORM_KEYS = frozenset({'category', 'amount', 'unit_from', 'unit_to', 'action'})
+
+
+def _parse_flat(body: str, keys: frozenset) -> Dict[str, str]:
+    """
+    Упрощенная замена parse_qs для тела формы: берет первое непустое значение
+    каждого нужного ключа и декодирует только его, без списков значений.
+    """
+    data: Dict[str, str] = {}
+    for pair in body.split('&'):
+        key, sep, value = pair.partition('=')
+        if sep and value and key in keys and key not in data:
+            data[key] = unquote_plus(value)
+    return data
 
-        # Приводим к базовой единице (factor=1.0), затем к целевой
-        base_value = value * units[from_unit]['factor']
-        return base_value / units[to_unit]['factor']
 
-    @staticmethod
-    def _convert_temp(value: float, from_unit: str, to_unit: str) -> float:
-        # Нормализация в Цельсий
-        celsius = value
-        if from_unit == 'f':
-            celsius = (value - 32) * 5 / 9
-        elif from_unit == 'k':
-            celsius = value - 273.15
-
-        # Конвертация из Цельсия
-        if to_unit == 'c':
-            return celsius
-        elif to_unit == 'f':
-            return (celsius * 9 / 5) + 32
-        elif to_unit == 'k':
-            return celsius + 273.15
-        return celsius
+@functools.lru_cache(maxsize=128)
+def _make_converter(category: str, from_unit: str, to_unit: str) -> Optional[Callable[[float], float]]:
+    """
+    Фабрика функций конвертации для пары единиц.
+    UNITS_CONFIG не меняется во время работы, поэтому результат можно кэшировать
+    без инвалидации: после первого вызова остается один вызов замыкания.
+    """
+    # Специфичная логика для температур: готовая функция из таблицы
+    if category == 'temperature':
+        return TEMP_FNS.get((from_unit, to_unit))
+
+    # Линейные величины: один готовый множитель на пару единиц
+    factor = FACTOR_TABLE.get((category, from_unit, to_unit))
+    if factor is None:
+        return None
+    return lambda value: value * factor
 
 
 class RequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1: соединение остается открытым между запросами (keep-alive),
+    # поэтому каждый ответ обязан содержать Content-Length
+    protocol_version = "HTTP/1.1"
+    # Простаивающее keep-alive соединение закрывается через 15 секунд,
+    # чтобы не занимать поток сервера навсегда
+    timeout = 15
+
     # Храним историю в памяти (при перезапуске сервера она сотрется)
     # В продакшене здесь была бы БД
-    request_history: List[Dict[str, str]] = []
+    # Записи хранятся уже отрендеренными в HTML.
+    # deque с maxlen сам вытесняет старые записи: храним только последние 5
+    request_history: ClassVar[Deque[str]] = deque(maxlen=5)
+    # Готовый HTML всей истории (новые записи сверху), пересобирается только при добавлении
+    history_html: ClassVar[str] = ''
+    # Каждый запрос обслуживается в своем потоке, поэтому историю защищаем блокировкой
+    history_lock = threading.Lock()
+
+    # Один экземпляр шаблонизатора на все запросы
+    template_engine = TemplateEngine('index_dynamic.html')
 
     def log_message(self, format, *args):
         # Переопределяем стандартный метод логирования
-        log_entry = "%s - - [%s] %s\n" % (
+        log_entry = "%s - - [%s] %s" % (
             self.client_address[0],
             self.log_date_time_string(),
             format % args
         )
 
-        # Вывод в консоль (чтобы вы видели, что происходит)
-        sys.stderr.write(log_entry)
-
-        # Запись в файл (добавляем в конец файла)
-        with open("responses.log", "a", encoding="utf-8") as f:
-            f.write(log_entry)
+        # Лог запускается лениво, если сервер собран не через run()
+        if _access_listener is None:
+            start_access_log()
+        # Запись только кладется в очередь; в консоль и файл ее пишет фоновый поток (см. start_access_log)
+        access_log.info(log_entry)
     
-    def _get_options_html(self, category: str, selected: str) -> str:
-        """Генерация <option> тегов."""
+    @classmethod
+    def _add_history(cls, from_val: str, to_val: str):
+        """Рендерит запись истории один раз при добавлении и пересобирает общий HTML."""
+        entry = HISTORY_ITEM_HTML.format(from_val=escape(from_val), to_val=escape(to_val))
+        with cls.history_lock:
+            cls.request_history.append(entry)
+            cls.history_html = "".join(reversed(cls.request_history))
+
+    @staticmethod
+    @functools.lru_cache(maxsize=64)
+    def _get_options_html(category: str, selected: str) -> str:
+        """
+        Генерация <option> тегов.
+        UNITS_CONFIG статичен, поэтому готовый HTML кэшируется по паре (категория, выбранная единица).
+        """
         if category not in UNITS_CONFIG:
             return ""
 
         options = []
         for code, data in UNITS_CONFIG[category]['units'].items():
             is_selected = 'selected' if code == selected else ''
-            options.append(f'<option value="{code}" {is_selected}>{data["name"]}</option>')
+            options.append(f'<option value="{escape(code)}" {is_selected}>{escape(data["name"])}</option>')
         return "\n".join(options)
 
     def do_GET(self):
@@ -200,7 +437,7 @@ class RequestHandler(BaseHTTPRequestHandler):
             'amount': 100,  # Дефолтное значение
             'unit_from_options': self._get_options_html(category, unit_from),
             'unit_to_options': self._get_options_html(category, unit_to),
-            'history': self.request_history,
+            'history_html': self.history_html,
             'result': '',  # Пусто при GET
         }
 
@@ -209,19 +446,19 @@ class RequestHandler(BaseHTTPRequestHandler):
     def do_POST(self):
         content_len = int(self.headers.get('Content-Length', 0))
         post_body = self.rfile.read(content_len).decode('utf-8')
-        data = parse_qs(post_body)
+        data = _parse_flat(post_body, FORM_KEYS)
 
         # Извлекаем данные с безопасными дефолтами
-        category = data.get('category', ['length'])[0]
-        amount_str = data.get('amount', ['0'])[0]
-        unit_from = data.get('unit_from', [''])[0]
-        unit_to = data.get('unit_to', [''])[0]
-        action = data.get('action', ['convert'])[0]
+        category = data.get('category', 'length')
+        amount_str = data.get('amount', '0')
+        unit_from = data.get('unit_from', '')
+        unit_to = data.get('unit_to', '')
+        action = data.get('action', 'convert')
 
         context = {
             'current_cat': category,
             'amount': amount_str,
-            'history': self.request_history,
+            'history_html': self.history_html,
             'result': '',
             'explanation': ''
         }
@@ -242,18 +479,13 @@ class RequestHandler(BaseHTTPRequestHandler):
                     context['result'] = res_formatted
 
                     # Формируем объяснение для UI
-                    u_from_name = UNITS_CONFIG[category]['units'][unit_from]['name']
-                    u_to_name = UNITS_CONFIG[category]['units'][unit_to]['name']
+                    u_from_name = UNIT_NAMES[(category, unit_from)]
+                    u_to_name = UNIT_NAMES[(category, unit_to)]
                     context['explanation'] = f"{amount_str} {u_from_name} = {res_formatted} {u_to_name}"
 
                     # Добавляем в историю
-                    self.request_history.append({
-                        'from_val': f"{amount_str} {u_from_name}",
-                        'to_val': f"{res_formatted} {u_to_name}"
-                    })
-                    # Держим только последние 5 записей
-                    if len(self.request_history) > 5:
-                        self.request_history.pop(0)
+                    self._add_history(f"{amount_str} {u_from_name}", f"{res_formatted} {u_to_name}")
+                    context['history_html'] = self.history_html
 
             except ValueError:
                 # Если пользователь ввел не число, просто игнорируем расчет
@@ -266,17 +498,53 @@ class RequestHandler(BaseHTTPRequestHandler):
         self._send_response(context)
 
     def _send_response(self, context: Dict[str, Any]):
-        engine = TemplateEngine('index_dynamic.html')
-        html = engine.render(context)
+        body = self.template_engine.render(context)
+
+        # Заголовки и тело уходят в сокет одной записью вместо нескольких
+        self.log_request(200)
+        # Клиент сам попросил закрыть соединение (или говорит на HTTP/1.0)
+        tail = b"\r\nConnection: close\r\n\r\n" if self.close_connection else b"\r\n\r\n"
+        dynamic_head = "Server: %s\r\nDate: %s\r\nContent-Length: %d" % (
+            self.version_string(),
+            self.date_time_string(),
+            len(body)
+        )
+        self.wfile.write(RESPONSE_HEAD + dynamic_head.encode('latin-1') + tail + body)
+
+
+def start_access_log(path: str = "responses.log") -> logging.handlers.QueueListener:
+    """
+    Подключает лог запросов через очередь: обработчик запроса только кладет запись
+    в очередь, а QueueListener в отдельном потоке пишет ее в консоль и в файл.
+    Повторный вызов возвращает уже запущенный listener, не дублируя записи.
+    """
+    global _access_listener
+    with _access_log_lock:
+        if _access_listener is not None:
+            return _access_listener
+
+        log_queue: queue.Queue = queue.Queue(-1)
+
+        formatter = logging.Formatter('%(message)s')
+        # Вывод в консоль (чтобы вы видели, что происходит) и запись в файл (добавляем в конец файла)
+        console_handler = logging.StreamHandler(sys.stderr)
+        file_handler = logging.FileHandler(path, encoding="utf-8")
+        for handler in (console_handler, file_handler):
+            handler.setFormatter(formatter)
+
+        listener = logging.handlers.QueueListener(log_queue, console_handler, file_handler)
+        listener.start()
+        # При завершении процесса дописываем оставшиеся в очереди записи
+        atexit.register(listener.stop)
 
-        self.send_response(200)
-        self.send_header('Content-type', 'text/html; charset=utf-8')
-        self.end_headers()
-        self.wfile.write(html.encode('utf-8'))
+        access_log.addHandler(logging.handlers.QueueHandler(log_queue))
+        _access_listener = listener
+        return listener
 
 
-def run(server_class=HTTPServer, handler_class=RequestHandler, port=8000):
+def run(server_class=ThreadingHTTPServer, handler_class=RequestHandler, port=8000):
     server_address = ('', port)
+    start_access_log()
     httpd = server_class(server_address, handler_class)
     print(f"Starting server on port {port}...")
     print(f"Open http://localhost:{port} in your browser.")